@@ -2,19 +2,104 @@ import os
 import re
 import shutil
 import typer
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import freeze_support
 
 app = typer.Typer()
 
-def process_file(file_path, output_folder, code_filters, link_to_source, code_dict):
+# Code formats
+# 1. Multiline code format: [[code]] == text == [[code]]
+MULTILINE_CODE_PATTERN = re.compile(r'\[\[(.*?)\]\]\s*==\s*(.*?)\s*==\s*\[\[\1\]\]', re.DOTALL)
+# 2. Single line code format: == text == [[code]] ^id-[identifier]
+SINGLE_LINE_CODE_PATTERN = re.compile(r'==\s*(.*?)\s*==\s*\[\[(.*?)\]\](?:\s*\^id-[^\s]+)?', re.DOTALL)
+
+def matches_code_filters(code, code_filters):
+    """
+    Check whether a code passes the code filters.
+
+    Args:
+        code (str): The code to check.
+        code_filters (list): List of compiled code filter patterns.
+
+    Returns:
+        bool: True if there are no filters or any filter matches the code.
+    """
+    return not code_filters or any(pattern.match(code) for pattern in code_filters)
+
+def extract_codes(file_path):
+    """
+    Read a file and find its coded text, without filtering or storing anything.
+
+    Args:
+        file_path (str): Path to the file to read.
+
+    Returns:
+        tuple: Content length, list of (code, text) multiline matches, and list of (text, code) single line matches.
+
+    The function has no side effects, so it can run in a worker process when processing folders in parallel.
+    """
+    # Read and decode the file
+    with open(file_path, 'rb') as file:
+        content = file.read().decode('utf-8')
+    if '\r' in content:
+        # Normalize line endings
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+
+    # Only scan files that contain code markers
+    if '==' in content and '[[' in content:
+        multiline_codes = MULTILINE_CODE_PATTERN.findall(content)
+        single_line_codes = SINGLE_LINE_CODE_PATTERN.findall(content)
+    else:
+        multiline_codes = []
+        single_line_codes = []
+
+    return len(content), multiline_codes, single_line_codes
+
+def extract_codes_batch(file_paths):
+    """
+    Run extract_codes on several files, capturing any error per file.
+
+    Args:
+        file_paths (list): Paths of the files to read.
+
+    Returns:
+        list: An (extract_codes result, error) pair for each file, where one of the two is None.
+
+    Batching lets a worker process handle several files per task.
+    """
+    results = []
+    for file_path in file_paths:
+        try:
+            results.append((extract_codes(file_path), None))
+        except Exception as error:
+            results.append((None, error))
+    return results
+
+def log_processing_file(file_path):
+    """
+    Print the progress line for a file.
+
+    Args:
+        file_path (str): Path to the file being processed.
+    """
+    print(f"Processing file: {file_path}")
+
+def process_file(file_path, output_folder, code_filters, link_to_source, code_dict, seen_texts=None, extracted_codes=None):
     """
     Process a single file and extract coded text.
 
     Args:
         file_path (str): Path to the file to process.
         output_folder (str): Path to the output folder.
-        code_filters (list): List of code filters (regex patterns).
+        code_filters (list): List of compiled code filter patterns.
         link_to_source (bool): Whether to include a link to the source file in the output.
         code_dict (dict): Dictionary to store the extracted codes and their associated text.
+        seen_texts (dict, optional): Set of texts already stored for each code, shared across files
+            so duplicate checks are constant time. Built from code_dict if not provided.
+        extracted_codes (tuple, optional): Result of extract_codes for this file, if it has already
+            been read (e.g. in the background). The file is read here if not provided.
 
     The function supports two code formats:
     1. Multiline code format: [[code]] == text == [[code]]
@@ -22,36 +107,40 @@ def process_file(file_path, output_folder, code_filters, link_to_source, code_di
 
     The extracted codes and their associated text are stored in the code_dict dictionary.
     """
-    print(f"Processing file: {file_path}")
-    with open(file_path, 'r', encoding='utf-8') as file:
-        content = file.read()
-        print(f"File content length: {len(content)}")
-        
-        multiline_codes = re.findall(r'\[\[(.*?)\]\]\s*==\s*(.*?)\s*==\s*\[\[\1\]\]', content, re.DOTALL)
-        print(f"Found {len(multiline_codes)} multiline codes")
-        
-        single_line_codes = re.findall(r'==\s*(.*?)\s*==\s*\[\[(.*?)\]\](?:\s*\^id-[^\s]+)?', content, re.DOTALL)
-        print(f"Found {len(single_line_codes)} single line codes")
-        
-        # Process multiline codes
-        for code, text in multiline_codes:
-            print(f"Processing multiline code: {code}")
-            if not code_filters or any(re.match(pattern, code, re.IGNORECASE) for pattern in code_filters):
-                if code not in code_dict:
-                    code_dict[code] = []
-                code_dict[code].append((text.strip(), file_path))
-        
-        # Process single line codes
-        for text, code in single_line_codes:
-            print(f"Processing single line code: {code}")
+    log_processing_file(file_path)
+    if seen_texts is None:
+        seen_texts = {code: {t[0] for t in text_list} for code, text_list in code_dict.items()}
+    if extracted_codes is None:
+        extracted_codes = extract_codes(file_path)
+    content_length, multiline_codes, single_line_codes = extracted_codes
+    print(f"File content length: {content_length}")
+    print(f"Found {len(multiline_codes)} multiline codes")
+    print(f"Found {len(single_line_codes)} single line codes")
+    
+    # Process multiline codes
+    for code, text in multiline_codes:
+        print(f"Processing multiline code: {code}")
+        if matches_code_filters(code, code_filters):
+            text = text.strip()
             if code not in code_dict:
-                if not code_filters or any(re.match(pattern, code, re.IGNORECASE) for pattern in code_filters):
-                    code_dict[code] = [(text.strip(), file_path)]
-            else:
-                existing_texts = [t[0] for t in code_dict[code]]
-                if text.strip() not in existing_texts:
-                    if not code_filters or any(re.match(pattern, code, re.IGNORECASE) for pattern in code_filters):
-                        code_dict[code].append((text.strip(), file_path))
+                code_dict[code] = []
+            code_dict[code].append((text, file_path))
+            seen_texts.setdefault(code, set()).add(text)
+    
+    # Process single line codes
+    for text, code in single_line_codes:
+        print(f"Processing single line code: {code}")
+        text = text.strip()
+        if code not in code_dict:
+            if matches_code_filters(code, code_filters):
+                code_dict[code] = [(text, file_path)]
+                seen_texts[code] = {text}
+        else:
+            existing_texts = seen_texts.setdefault(code, set())
+            if text not in existing_texts:
+                if matches_code_filters(code, code_filters):
+                    code_dict[code].append((text, file_path))
+                    existing_texts.add(text)
     
     print(f"Processed codes: {list(code_dict.keys())}") 
 
@@ -67,36 +156,136 @@ def write_code_files(code_dict, output_folder, link_to_source):
     The function creates a separate file for each code in the output folder.
     If link_to_source is True, it includes a link to the source file in the output.
     """
+    # Relative source links by input file
+    relative_paths = {}
+    created_folders = set()
+
     for code, text_list in code_dict.items():
         code_file = os.path.join(output_folder, f"{code}.md")
-        os.makedirs(os.path.dirname(code_file), exist_ok=True)
+        code_folder = os.path.dirname(code_file)
+        if code_folder not in created_folders:
+            os.makedirs(code_folder, exist_ok=True)
+            created_folders.add(code_folder)
+
+        parts = []
+        for text, file_path in text_list:
+            if link_to_source:
+                if file_path not in relative_paths:
+                    relative_paths[file_path] = os.path.relpath(file_path, output_folder)
+                relative_path = relative_paths[file_path]
+                parts.append(f"## [{relative_path}]({relative_path})\n\n")
+            parts.append(text + "\n\n")
+
         with open(code_file, 'w', encoding='utf-8') as out_file:
-            for text, file_path in text_list:
-                if link_to_source:
-                    relative_path = os.path.relpath(file_path, output_folder)
-                    out_file.write(f"## [{relative_path}]({relative_path})\n\n")
-                out_file.write(text + "\n\n")
+            out_file.write("".join(parts))
+
+def find_files(folder_path, extensions):
+    """
+    Find all files with the given extensions in a folder and its subfolders.
+
+    Args:
+        folder_path (str): Path to the folder to search.
+        extensions (list): List of file extensions to include.
+
+    Yields:
+        str: Path to each matching file, in the order they are found.
+
+    Files are yielded lazily, so processing can start before the whole folder tree has been walked.
+    """
+    extensions = frozenset(extensions)
+
+    # Walk folders top-down, like os.walk
+    stack = [folder_path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                entries = list(entries)
+        except OSError:
+            # Skip unreadable folders
+            continue
+
+        subfolders = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                # Don't follow symlinked folders
+                if not entry.is_symlink():
+                    subfolders.append(entry.path)
+                continue
 
-def process_folder(folder_path, output_folder, code_filters, extensions, link_to_source):
+            _, ext = os.path.splitext(entry.name)
+
+            if ext.lower() in extensions:
+                yield entry.path
+
+        # Visit subfolders in listing order
+        stack.extend(reversed(subfolders))
+
+def prefetch_codes(file_paths, executor, depth, batch_size=1):
+    """
+    Extract codes from files while reading ahead on an executor.
+
+    Args:
+        file_paths (iterable): Paths of the files to read, in processing order.
+        executor (Executor): Background thread or worker processes that run extract_codes_batch.
+        depth (int): Maximum number of batches to read ahead.
+        batch_size (int, optional): Number of files per task. Defaults to 1.
+
+    Yields:
+        tuple: The file path, its extract_codes result, and the error raised reading it (or None),
+            in the same order as file_paths.
+
+    Reading the next files overlaps with processing the current one, and only depth batches are queued
+    at a time, so an error stops the run without scanning the rest of the folder first.
+    """
+    file_paths = iter(file_paths)
+    pending = deque()
+    try:
+        while True:
+            batch = list(islice(file_paths, batch_size))
+            if batch:
+                pending.append((batch, executor.submit(extract_codes_batch, batch)))
+            if not pending:
+                break
+
+            if len(pending) > depth or not batch:
+                batch, future = pending.popleft()
+                for file_path, (extracted_codes, error) in zip(batch, future.result()):
+                    yield file_path, extracted_codes, error
+    finally:
+        # Cancel reads that will not be used
+        for _, future in pending:
+            future.cancel()
+
+def process_folder(folder_path, output_folder, code_filters, extensions, link_to_source, jobs=1):
     """
     Process all files in a folder and its subfolders.
 
     Args:
         folder_path (str): Path to the folder to process.
         output_folder (str): Path to the output folder.
-        code_filters (list): List of code filters (regex patterns).
+        code_filters (list): List of compiled code filter patterns.
         extensions (list): List of file extensions to process.
         link_to_source (bool): Whether to include a link to the source file in the output.
+        jobs (int, optional): Number of worker processes used to read and scan files. Defaults to 1.
 
     Returns:
         int: Count of processed files.
 
     The function recursively processes all files with the specified extensions in the folder and its subfolders.
-    It calls the process_file function for each file and stores the extracted codes and their associated text in a dictionary.
+    It calls the process_file function for each file found by find_files and stores the extracted codes and their associated text in a dictionary.
+    Files are read ahead on a background thread by prefetch_codes.
+    With more than one job, files are instead read and scanned in worker processes. Either way the
+    results are merged in the same order as a sequential run, so the output is identical.
     Finally, it calls the write_code_files function to write the extracted codes to individual files.
     """
     count = 0
     code_dict = {}
+    seen_texts = {}
 
     if not os.path.exists(folder_path):
         print(f"Error: Folder '{folder_path}' does not exist.")
@@ -106,14 +295,25 @@ def process_folder(folder_path, output_folder, code_filters, extensions, link_to
         print(f"Error: '{folder_path}' is not a valid directory.")
         return count
 
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            _, ext = os.path.splitext(file)
-            
-            if ext.lower() in extensions:
-                file_path = os.path.join(root, file)
-                process_file(file_path, output_folder, code_filters, link_to_source, code_dict)
-                count += 1
+    if jobs > 1:
+        # Batches of files per worker task, two batches queued per worker
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        depth = jobs * 2
+        batch_size = 16
+    else:
+        executor = ThreadPoolExecutor(max_workers=1)
+        depth = 4
+        batch_size = 1
+
+    with executor:
+        file_paths = find_files(folder_path, extensions)
+        for file_path, extracted_codes, error in prefetch_codes(file_paths, executor, depth, batch_size):
+            if error is not None:
+                # Name the file that failed before the error
+                log_processing_file(file_path)
+                raise error
+            process_file(file_path, output_folder, code_filters, link_to_source, code_dict, seen_texts, extracted_codes)
+            count += 1
 
     write_code_files(code_dict, output_folder, link_to_source)
     return count
@@ -123,7 +323,8 @@ def main(input_path: str,
          output_folder: str = None, 
          code_filters: str = None, 
          extensions: str = '', 
-         link_to_source: bool = False):
+         link_to_source: bool = False,
+         jobs: int = 1):
     """
     Main function to process files and extract coded text.
 
@@ -133,17 +334,21 @@ def main(input_path: str,
         code_filters (str, optional): Comma-separated list of code filters. Defaults to None.
         extensions (str, optional): Comma-separated list of file extensions to process. Defaults to an empty string.
         link_to_source (bool, optional): Whether to include a link to the source file in the output. Defaults to False.
+        jobs (int, optional): Number of worker processes used to read and scan files in a folder. Defaults to 1.
 
     The function processes the input file or folder and extracts coded text based on the specified code formats.
     It applies code filters (if provided) to filter the extracted codes.
     The extracted codes and their associated text are written to individual files in the output folder.
     """
+    if jobs < 1:
+        raise typer.BadParameter("--jobs must be at least 1")
+
     # Process code filters
     if code_filters:
         # Split code_filters if it's a string of comma-separated values
         code_filters = code_filters.split(',')
         # Convert wildcards to regex format
-        code_filters_regex = [re.escape(f).replace("\\*", ".*") for f in code_filters]
+        code_filters_regex = [re.compile(re.escape(f).replace("\\*", ".*"), re.IGNORECASE) for f in code_filters]
         # Create a string with filters for the folder name
         filter_folder_suffix = '_' + '_'.join(code_filters)
     else:
@@ -180,7 +385,7 @@ def main(input_path: str,
         write_code_files(code_dict, output_folder, link_to_source)
         processed_count = 1
     else:
-        processed_count = process_folder(input_path, output_folder, code_filters_regex, extensions, link_to_source)
+        processed_count = process_folder(input_path, output_folder, code_filters_regex, extensions, link_to_source, jobs)
 
     # Output results
     print(f"Structur completed. Output files are in the '{output_folder}' folder.")
@@ -192,4 +397,6 @@ def main(input_path: str,
     print(f"\nTotal files processed: {processed_count}")    
 
 if __name__ == "__main__":
+    # Needed for worker processes when running as a packaged executable
+    freeze_support()
     app()
\ No newline at end of file